@@ -1,33 +1,75 @@
 import boto3
 import json
 from collections import defaultdict
-from app.models import UserAttachedPolicy, UserInlinePolicy, db, Account, Role, AttachedPolicy, InlinePolicy, User, TrustedUser
+from datetime import datetime, timedelta
+from fnmatch import fnmatchcase
+from urllib.parse import unquote
+from botocore.exceptions import ClientError, ParamValidationError
+from app.iam_archive import ArchiveMissError, IAMArchive
+from app.models import UserAttachedPolicy, UserInlinePolicy, db, Account, Role, AttachedPolicy, InlinePolicy, User, TrustedUser, SyncCheckpoint
 from sqlalchemy.orm import scoped_session, sessionmaker
 from flask import current_app
 import asyncio
+import click
 import logging
 
+RETRYABLE_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+    'ServiceUnavailable',
+    'ServiceFailure',
+    'InternalFailure'
+}
+
+
 class AWSRoleAnalyzer:
-    def __init__(self, sts_client, session):
+    # Fetching runs in worker threads and only produces plain dict records.
+    # A single writer coroutine owns the session, applies the records and
+    # commits every `checkpoint_size` records together with per-account
+    # progress, so an interrupted sync resumes from its last checkpoint.
+    # With `record_archive` every IAM/STS response is appended to a
+    # per-account IAMArchive; with `replay_archive` the IAM clients are
+    # replaced by ReplayClients reading from one, and no AWS call is made.
+    def __init__(self, sts_client, session, fetch_workers=8, queue_size=100, checkpoint_size=25, checkpoint_max_age=86400, restart=False, record_archive=None, replay_archive=None):
         self.sts_client = sts_client
         self.session = session
+        self.fetch_workers = fetch_workers
+        self.queue_size = queue_size
+        self.checkpoint_size = checkpoint_size
+        self.checkpoint_max_age = timedelta(seconds=checkpoint_max_age)
+        self.restart = restart
+        self.record_archive = record_archive
+        self.replay_archive = replay_archive
         self.results = {}
         self.trusted_users = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+        self.progress = {}
+        self.checkpoints = {}
+        self.dirty_checkpoints = set()
         self.logger = logging.getLogger(__name__)
 
     def assume_role(self, role_arn):
+        account_number = self.extract_account_number(role_arn)
+        if self.replay_archive:
+            # A missing or unreadable archive is not an STS failure; let it
+            # fail the account's sync instead of skipping it.
+            return self.replay_archive.client(account_number)
+
         try:
-            response = self.sts_client.assume_role(
-                RoleArn=role_arn,
-                RoleSessionName='AssumeRoleSession'
-            )
+            params = {'RoleArn': role_arn, 'RoleSessionName': 'AssumeRoleSession'}
+            response = self.sts_client.assume_role(**params)
             credentials = response['Credentials']
-            return boto3.client(
+            iam_client = boto3.client(
                 'iam',
                 aws_access_key_id=credentials['AccessKeyId'],
                 aws_secret_access_key=credentials['SecretAccessKey'],
                 aws_session_token=credentials['SessionToken']
             )
+            if self.record_archive:
+                self.record_archive.record(account_number, 'AssumeRole', params, response)
+                self.record_archive.attach(iam_client, account_number)
+            return iam_client
         except Exception as e:
             self.logger.error(f"Error assuming role {role_arn}: {e}")
             return None
@@ -45,10 +87,22 @@ class AWSRoleAnalyzer:
         except iam_client.exceptions.NoSuchEntityException:
             self.logger.warning(f"Role '{role_name}' not found.")
             return None
-        except Exception as e:
-            self.logger.error(f"Error getting role info for {role_name}: {e}")
+        except (ClientError, ParamValidationError) as e:
+            if not self.is_permanent_error(e):
+                raise
+            self.logger.error(f"Skipping role '{role_name}': {e}")
             return None
 
+    def is_permanent_error(self, error):
+        # Throttling and server-side failures interrupt the sync so the
+        # checkpoint resumes them; errors that would fail the same way on
+        # every retry (bad parameters, AccessDenied, ...) skip the principal.
+        if isinstance(error, ParamValidationError):
+            return True
+        code = error.response.get('Error', {}).get('Code')
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode') or 0
+        return code not in RETRYABLE_ERROR_CODES and status < 500
+
     def get_policy_document(self, iam_client, policy_arn):
         try:
             policy = iam_client.get_policy(PolicyArn=policy_arn)
@@ -57,6 +111,8 @@ class AWSRoleAnalyzer:
                 VersionId=policy['Policy']['DefaultVersionId']
             )
             return policy_version['PolicyVersion']['Document']
+        except ArchiveMissError:
+            raise
         except Exception as e:
             self.logger.error(f"Error fetching policy document for {policy_arn}: {e}")
             return None
@@ -85,190 +141,623 @@ class AWSRoleAnalyzer:
             for action in actions:
                 permissions_summary[effect].add(action)
 
-    async def analyze_account(self, account):
-        iam_client = self.assume_role(account.role_arn)
+    async def analyze_account(self, account, roles=None, users=None, inventory=None):
+        await self.analyze_accounts([account], roles=roles, users=users, inventory=inventory)
+
+    async def sync_role(self, account, role_name):
+        await self.sync_roles(account, [role_name])
+
+    async def sync_user(self, account, user_name):
+        await self.sync_users(account, [user_name])
+
+    async def sync_roles(self, account, role_names=None, inventory=None):
+        await self.analyze_account(account, roles=role_names, users=[], inventory=inventory)
+
+    async def sync_users(self, account, user_names=None):
+        await self.analyze_account(account, roles=[], users=user_names)
+
+    async def analyze_accounts(self, accounts, roles=None, users=None, inventory=None):
+        # `roles`/`users` narrow the sync: None means every configured role or
+        # every IAM user, a list means exactly those names. Only full syncs are
+        # checkpointed, and only a full role scope removes stale roles.
+        # `inventory` (see build_inventory) replaces the configured role list
+        # with every role returned by list_roles that passes its filters.
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        semaphore = asyncio.Semaphore(self.fetch_workers)
+        checkpointed = roles is None and users is None
+        scope = {'mode': 'configured'} if inventory is None else dict(inventory, mode='inventory')
+
+        producers = []
+        for account in accounts:
+            if checkpointed:
+                account_number = self.extract_account_number(account.role_arn)
+                self.progress[account_number] = self.load_checkpoint(account_number, scope)
+            producers.append(self.produce_account(account, queue, semaphore, roles, users, inventory))
+
+        writer = asyncio.create_task(self.write_records(queue))
+        producing = asyncio.ensure_future(asyncio.gather(*producers, return_exceptions=True))
+
+        try:
+            done, _ = await asyncio.wait({writer, producing}, return_when=asyncio.FIRST_COMPLETED)
+            if writer in done:
+                # The writer only stops on its own when it failed; nothing would drain the queue.
+                producing.cancel()
+                await asyncio.gather(producing, return_exceptions=True)
+                writer.result()
+
+            await queue.put(None)
+            await writer
+        finally:
+            if self.record_archive:
+                self.record_archive.close()
+
+        errors = [result for result in producing.result() if isinstance(result, Exception)]
+        for error in errors:
+            self.logger.error(f"Sync interrupted, progress kept at last checkpoint: {error}")
+        if errors:
+            raise errors[0]
+
+    def load_checkpoint(self, account_id, scope):
+        # A checkpoint is only resumed by a sync of the same kind: the roles a
+        # configured sync completed were never flagged as inventory roles, and
+        # a differently filtered inventory covers a different set of roles.
+        fresh = {'roles': set(), 'users': set(), 'scope': scope}
+        checkpoint = self.session.get(SyncCheckpoint, account_id)
+        if not checkpoint or checkpoint.status != 'in_progress':
+            return fresh
+        if self.restart:
+            self.logger.warning(f"Ignoring checkpoint of account {account_id} from {checkpoint.updated_at}, starting a fresh sync")
+            return fresh
+        if datetime.utcnow() - checkpoint.updated_at > self.checkpoint_max_age:
+            self.logger.warning(f"Checkpoint of account {account_id} from {checkpoint.updated_at} is older than {self.checkpoint_max_age}, starting a fresh sync")
+            return fresh
+        if checkpoint.scope != scope:
+            self.logger.warning(f"Checkpoint of account {account_id} was left by a different kind of sync ({checkpoint.scope}), starting a fresh sync")
+            return fresh
+        self.logger.warning(
+            f"Resuming sync of account {account_id} from checkpoint {checkpoint.updated_at}, skipping "
+            f"{len(checkpoint.completed_roles)} roles and {len(checkpoint.completed_users)} users already synced"
+        )
+        return {'roles': set(checkpoint.completed_roles), 'users': set(checkpoint.completed_users), 'scope': scope}
+
+    async def produce_account(self, account, queue, semaphore, roles=None, users=None, inventory=None):
+        iam_client = await asyncio.to_thread(self.assume_role, account.role_arn)
         if not iam_client:
             return
 
-        account_name = account.account_name
         account_number = self.extract_account_number(account.role_arn)
-        self.results[account_name] = {}
-
-        account_db = self.session.get(Account, account_number)
-        if not account_db:
-            account_db = Account(id=account_number, account_name=account_name)
-            self.session.add(account_db)
+        roles_to_analyze = list(account.roles_to_analyze)
+        self.results[account.account_name] = {}
+        progress = self.progress.get(account_number, {'roles': set(), 'users': set()})
+
+        await queue.put({
+            'kind': 'account',
+            'account_id': account_number,
+            'account_name': account.account_name,
+            'role_arn': account.role_arn,
+            'roles_to_analyze': roles_to_analyze
+        })
+
+        async def fetch(fetch_record, *args):
+            # The semaphore is held until the record is queued, so a slow
+            # writer stalls the fetch workers instead of buffering records.
+            async with semaphore:
+                record = await asyncio.to_thread(fetch_record, iam_client, account_number, *args)
+                if record:
+                    await queue.put(record)
+
+        if inventory is not None and roles is None:
+            fetches, listed_roles = await self.produce_inventory(iam_client, inventory, progress, fetch)
+            synced_roles = listed_roles if self.is_full_inventory(inventory) else None
         else:
-            account_db.account_name = account_name
+            role_names = roles_to_analyze if roles is None else roles
+            fetches = [asyncio.create_task(fetch(self.fetch_role, role_name)) for role_name in role_names if role_name not in progress['roles']]
+            synced_roles = roles_to_analyze if roles is None else None
 
-        existing_roles = set(role.role_name for role in Role.query.filter_by(account_id=account_db.id).all())
+        try:
+            if users is None:
+                user_names = [user['UserName'] for user in await asyncio.to_thread(self.list_users, iam_client)]
+            else:
+                user_names = users
+        except Exception:
+            # Role fetches are already running; stop them before the writer
+            # is told the sync is over.
+            for task in fetches:
+                task.cancel()
+            await asyncio.gather(*fetches, return_exceptions=True)
+            raise
+        fetches += [asyncio.create_task(fetch(self.fetch_user, user_name)) for user_name in user_names if user_name not in progress['users']]
+
+        results = await asyncio.gather(*fetches, return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+
+        await queue.put({
+            'kind': 'account_done',
+            'account_id': account_number,
+            'synced_roles': synced_roles,
+            'inventory': inventory is not None and roles is None,
+            'roles_to_analyze': roles_to_analyze
+        })
+
+    async def produce_inventory(self, iam_client, inventory, progress, fetch):
+        # Pages are pulled one at a time so role fetches start while the
+        # listing is still running.
+        fetches = []
+        listed_roles = []
+        pages = iter(iam_client.get_paginator('list_roles').paginate(PathPrefix=inventory['path_prefix']))
+        try:
+            while True:
+                page = await asyncio.to_thread(next, pages, None)
+                if page is None:
+                    break
+                for role in page['Roles']:
+                    listed_roles.append(role['RoleName'])
+                    if role['RoleName'] not in progress['roles'] and self.role_name_matches(role['RoleName'], inventory):
+                        fetches.append(asyncio.create_task(fetch(self.fetch_listed_role, role, inventory)))
+        except Exception:
+            await asyncio.gather(*fetches, return_exceptions=True)
+            raise
+        return fetches, listed_roles
+
+    def list_users(self, iam_client):
+        users = []
+        for page in iam_client.get_paginator('list_users').paginate():
+            users.extend(page['Users'])
+        return users
+
+    def build_inventory(self, path_prefix=None, name_patterns=(), tags=None):
+        return {
+            'path_prefix': path_prefix or '/',
+            'name_patterns': list(name_patterns),
+            'tags': dict(tags or {})
+        }
+
+    def is_full_inventory(self, inventory):
+        return inventory['path_prefix'] == '/' and not inventory['name_patterns'] and not inventory['tags']
+
+    def role_name_matches(self, role_name, inventory):
+        patterns = inventory['name_patterns']
+        return not patterns or any(fnmatchcase(role_name, pattern) for pattern in patterns)
+
+    def role_tags_match(self, iam_client, role_name, inventory):
+        # list_roles pages carry no tags, so they are only looked up for
+        # roles that already passed the name filter.
+        if not inventory['tags']:
+            return True
+        role_tags = {}
+        for page in iam_client.get_paginator('list_role_tags').paginate(RoleName=role_name):
+            role_tags.update((tag['Key'], tag['Value']) for tag in page['Tags'])
+        for key, value in inventory['tags'].items():
+            if key not in role_tags or (value is not None and role_tags[key] != value):
+                return False
+        return True
+
+    def parse_policy_document(self, document):
+        if isinstance(document, str):
+            return json.loads(unquote(document))
+        return document
+
+    def fetch_role(self, iam_client, account_id, role_name):
+        role_info = self.get_role_info(iam_client, role_name)
+        if not role_info:
+            return None
 
-        tasks = []
-        for role_name in account.roles_to_analyze:
-            tasks.append(asyncio.create_task(self.analyze_role(iam_client, role_name, account_db)))
-            if role_name in existing_roles:
-                existing_roles.remove(role_name)
+        return self.build_role_record(
+            iam_client,
+            account_id,
+            role_name,
+            role_info['role']['Role']['AssumeRolePolicyDocument'],
+            role_info['attached_policies'],
+            role_info['inline_policies']
+        )
+
+    def fetch_listed_role(self, iam_client, account_id, role, inventory):
+        role_name = role['RoleName']
+        try:
+            if not self.role_tags_match(iam_client, role_name, inventory):
+                return None
+            attached_policies = iam_client.list_attached_role_policies(RoleName=role_name)
+            inline_policies = iam_client.list_role_policies(RoleName=role_name)
+        except iam_client.exceptions.NoSuchEntityException:
+            self.logger.warning(f"Role '{role_name}' was deleted while listing roles.")
+            return None
+        except (ClientError, ParamValidationError) as e:
+            if not self.is_permanent_error(e):
+                raise
+            self.logger.error(f"Skipping role '{role_name}': {e}")
+            return None
 
-        await asyncio.gather(*tasks)
+        record = self.build_role_record(
+            iam_client,
+            account_id,
+            role_name,
+            self.parse_policy_document(role['AssumeRolePolicyDocument']),
+            attached_policies,
+            inline_policies
+        )
+        record['inventory'] = True
+        return record
+
+    def build_role_record(self, iam_client, account_id, role_name, trust_policy, attached_policy_list, inline_policy_list):
+        permissions_summary = defaultdict(set)
+
+        attached_policies = {}
+        for policy in attached_policy_list['AttachedPolicies']:
+            policy_document = self.get_policy_document(iam_client, policy['PolicyArn'])
+            if policy_document:
+                self.summarize_permissions(policy_document, permissions_summary)
+                attached_policies[policy['PolicyName']] = policy_document
 
-        for role_name in existing_roles:
-            await self.remove_role(account_db.id, role_name)
+        inline_policies = {}
+        for policy_name in inline_policy_list['PolicyNames']:
+            policy_document = iam_client.get_role_policy(RoleName=role_name, PolicyName=policy_name)
+            if 'PolicyDocument' in policy_document:
+                self.summarize_permissions(policy_document['PolicyDocument'], permissions_summary)
+                inline_policies[policy_name] = policy_document['PolicyDocument']
+
+        return {
+            'kind': 'role',
+            'account_id': account_id,
+            'name': role_name,
+            'trust_policy': trust_policy,
+            'permissions_summary': {k: list(v) for k, v in permissions_summary.items()},
+            'attached_policies': attached_policies,
+            'inline_policies': inline_policies,
+            'trusted_entities': self.extract_trusted_entities(trust_policy)
+        }
+
+    def fetch_user(self, iam_client, account_id, user_name):
+        try:
+            user_policies = iam_client.list_attached_user_policies(UserName=user_name)
+        except iam_client.exceptions.NoSuchEntityException:
+            self.logger.warning(f"User '{user_name}' not found.")
+            return None
+        except (ClientError, ParamValidationError) as e:
+            if not self.is_permanent_error(e):
+                raise
+            self.logger.error(f"Skipping user '{user_name}': {e}")
+            return None
 
-        await self.get_users_and_policies(account)
+        attached_policies = {}
+        for policy in user_policies['AttachedPolicies']:
+            policy_document = self.get_policy_document(iam_client, policy['PolicyArn'])
+            if policy_document:
+                attached_policies[policy['PolicyName']] = policy_document
 
+        inline_policies = {}
+        for policy_name in iam_client.list_user_policies(UserName=user_name)['PolicyNames']:
+            policy_document = iam_client.get_user_policy(UserName=user_name, PolicyName=policy_name)
+            if 'PolicyDocument' in policy_document:
+                inline_policies[policy_name] = policy_document['PolicyDocument']
+
+        return {
+            'kind': 'user',
+            'account_id': account_id,
+            'name': user_name,
+            'attached_policies': attached_policies,
+            'inline_policies': inline_policies
+        }
+
+    async def write_records(self, queue):
+        pending = 0
+        try:
+            while True:
+                record = await queue.get()
+                if record is None:
+                    break
+                self.apply_record(record)
+                pending += 1
+                if record['kind'] == 'account_done' or pending >= self.checkpoint_size:
+                    self.commit_checkpoint()
+                    pending = 0
+            if pending:
+                self.commit_checkpoint()
+        except Exception:
+            self.session.rollback()
+            raise
+
+    def apply_record(self, record):
+        kind = record['kind']
+        progress = self.progress.get(record['account_id'], {'roles': set(), 'users': set()})
+        if kind == 'account':
+            self.save_account(record)
+        elif kind == 'role':
+            self.save_role(record)
+            progress['roles'].add(record['name'])
+        elif kind == 'user':
+            self.save_user(record)
+            progress['users'].add(record['name'])
+        elif kind == 'account_done':
+            self.finish_account(record)
+        if kind in ('role', 'user') and record['account_id'] in self.checkpoints:
+            self.dirty_checkpoints.add(record['account_id'])
+
+    def commit_checkpoint(self):
+        # Only accounts that received records since the previous commit are
+        # written, with a plain UPDATE: flushing the expired SyncCheckpoint
+        # instances would reload each of them first.
+        for account_id in self.dirty_checkpoints:
+            progress = self.progress[account_id]
+            self.session.query(SyncCheckpoint).filter_by(account_id=account_id).update({
+                'completed_roles': sorted(progress['roles']),
+                'completed_users': sorted(progress['users'])
+            }, synchronize_session=False)
+        self.dirty_checkpoints.clear()
         self.session.commit()
+        if self.record_archive:
+            self.record_archive.flush()
+
+    def save_account(self, record):
+        account_db = self.session.get(Account, record['account_id'])
+        if not account_db:
+            account_db = Account(
+                id=record['account_id'],
+                account_name=record['account_name'],
+                role_arn=record['role_arn'],
+                roles_to_analyze=record['roles_to_analyze']
+            )
+            self.session.add(account_db)
+        else:
+            account_db.account_name = record['account_name']
+
+        if record['account_id'] not in self.progress:
+            return
+        checkpoint = self.session.get(SyncCheckpoint, record['account_id'])
+        if not checkpoint:
+            checkpoint = SyncCheckpoint(account_id=record['account_id'])
+            self.session.add(checkpoint)
+        checkpoint.status = 'in_progress'
+        checkpoint.scope = self.progress[record['account_id']]['scope']
+        self.checkpoints[record['account_id']] = checkpoint
+
+    def finish_account(self, record):
+        account_id = record['account_id']
+        if record['synced_roles'] is not None:
+            # Configured syncs only remove roles that came from the configured
+            # list, and a full inventory only removes roles it found earlier;
+            # a configured role missing from the inventory just loses its flag.
+            synced_roles = set(record['synced_roles'])
+            for role in self.session.query(Role).filter_by(account_id=account_id).all():
+                if role.role_name in synced_roles:
+                    continue
+                if record['inventory']:
+                    if not role.in_inventory:
+                        continue
+                    if role.role_name in record['roles_to_analyze']:
+                        role.in_inventory = False
+                        continue
+                elif role.in_inventory:
+                    continue
+                self.delete_role(account_id, role.role_name)
+
+        if account_id not in self.checkpoints:
+            return
+        checkpoint = self.checkpoints.pop(account_id)
+        checkpoint.status = 'complete'
+        checkpoint.completed_roles = []
+        checkpoint.completed_users = []
+        self.dirty_checkpoints.discard(account_id)
+        del self.progress[account_id]
 
     async def remove_role(self, account_id, role_name):
-        role = Role.query.filter_by(account_id=account_id, role_name=role_name).first()
+        self.delete_role(account_id, role_name)
+        self.session.commit()
+
+    def delete_role(self, account_id, role_name):
+        role = self.session.query(Role).filter_by(account_id=account_id, role_name=role_name).first()
         if role:
-            AttachedPolicy.query.filter_by(role_id=role.id).delete()
-            InlinePolicy.query.filter_by(role_id=role.id).delete()
-            TrustedUser.query.filter_by(role_id=role.id).delete()
+            self.session.query(AttachedPolicy).filter_by(role_id=role.id).delete()
+            self.session.query(InlinePolicy).filter_by(role_id=role.id).delete()
+            self.session.query(TrustedUser).filter_by(role_id=role.id).delete()
             self.session.delete(role)
             self.logger.info(f"Removed role '{role_name}' and its associated data from account {account_id}")
 
-    async def analyze_role(self, iam_client, role_name, account_db):
-        role_info = self.get_role_info(iam_client, role_name)
-        if role_info:
-            trust_policy = role_info['role']['Role']['AssumeRolePolicyDocument']
-            trusted_entities = self.extract_trusted_entities(trust_policy)
-
-            permissions_summary = defaultdict(set)
-            for policy in role_info['attached_policies']['AttachedPolicies']:
-                policy_document = self.get_policy_document(iam_client, policy['PolicyArn'])
-                if policy_document:
-                    self.summarize_permissions(policy_document, permissions_summary)
-
-            for policy_name in role_info['inline_policies']['PolicyNames']:
-                policy_document = iam_client.get_role_policy(RoleName=role_name, PolicyName=policy_name)
-                self.summarize_permissions(policy_document['PolicyDocument'], permissions_summary)
-
-            role = Role.query.filter_by(role_name=role_name, account_id=account_db.id).first()
-            if not role:
-                role = Role(
-                    role_name=role_name,
-                    trust_policy=json.dumps(trust_policy),
-                    permissions_summary=json.dumps({k: list(v) for k, v in permissions_summary.items()}),
-                    account_id=account_db.id
+    def save_role(self, record):
+        account_id = record['account_id']
+        trust_policy = json.dumps(record['trust_policy'])
+        permissions_summary = json.dumps(record['permissions_summary'])
+
+        role = self.session.query(Role).filter_by(role_name=record['name'], account_id=account_id).first()
+        if not role:
+            role = Role(
+                role_name=record['name'],
+                trust_policy=trust_policy,
+                permissions_summary=permissions_summary,
+                in_inventory=record.get('inventory', False),
+                account_id=account_id
+            )
+            self.session.add(role)
+            self.session.flush()
+        else:
+            role.trust_policy = trust_policy
+            role.permissions_summary = permissions_summary
+            if record.get('inventory'):
+                role.in_inventory = True
+
+        for policy_name, policy_document in record['attached_policies'].items():
+            attached_policy = self.session.query(AttachedPolicy).filter_by(name=policy_name, role_id=role.id).first()
+            if not attached_policy:
+                attached_policy = AttachedPolicy(
+                    name=policy_name,
+                    document=json.dumps(policy_document),
+                    role_id=role.id
                 )
-                self.session.add(role)
-                self.session.flush()
-
-            for policy in role_info['attached_policies']['AttachedPolicies']:
-                policy_document = self.get_policy_document(iam_client, policy['PolicyArn'])
-                if policy_document:
-                    attached_policy = AttachedPolicy.query.filter_by(name=policy['PolicyName'], role_id=role.id).first()
-                    if not attached_policy:
-                        attached_policy = AttachedPolicy(
-                            name=policy['PolicyName'],
-                            document=json.dumps(policy_document),
-                            role_id=role.id
-                        )
-                        self.session.add(attached_policy)
-
-            for policy_name in role_info['inline_policies']['PolicyNames']:
-                policy_document = iam_client.get_role_policy(RoleName=role_name, PolicyName=policy_name)
-                inline_policy = InlinePolicy.query.filter_by(name=policy_name, role_id=role.id).first()
-                if not inline_policy:
-                    inline_policy = InlinePolicy(
-                        name=policy_name,
-                        document=json.dumps(policy_document['PolicyDocument']) if 'PolicyDocument' in policy_document else None,
-                        role_id=role.id
-                    )
-                    self.session.add(inline_policy)
-
-            for entity in trusted_entities:
-                trusted_user = TrustedUser.query.filter_by(user_arn=entity, account_id=account_db.id, role_id=role.id).first()
-                if not trusted_user:
-                    trusted_user = TrustedUser(
-                        user_arn=entity,
-                        account_id=account_db.id,
-                        role_id=role.id
-                    )
-                    self.session.add(trusted_user)
-
-    async def get_users_and_policies(self, account):
-        iam_client = self.assume_role(account.role_arn)
-        users = iam_client.list_users()['Users']
-
-        tasks = []
-        for user in users:
-            tasks.append(asyncio.create_task(self.process_user(iam_client, user, account)))
-
-        await asyncio.gather(*tasks)
-
-    async def process_user(self, iam_client, user, account):
-        user_name = user['UserName']
-        attached_policies = iam_client.list_attached_user_policies(UserName=user_name)
-        inline_policies = iam_client.list_user_policies(UserName=user_name)
-
-        attached_policy_names = [policy['PolicyName'] for policy in attached_policies['AttachedPolicies']]
-        attached_policy_arns = [policy['PolicyArn'] for policy in attached_policies['AttachedPolicies']]
-        inline_policy_names = [policy for policy in inline_policies['PolicyNames']]
-
-        user_record = User.query.filter_by(user_name=user_name, account_id=account.id).first()
+                self.session.add(attached_policy)
+            else:
+                attached_policy.document = json.dumps(policy_document)
+
+        for policy_name, policy_document in record['inline_policies'].items():
+            inline_policy = self.session.query(InlinePolicy).filter_by(name=policy_name, role_id=role.id).first()
+            if not inline_policy:
+                inline_policy = InlinePolicy(
+                    name=policy_name,
+                    document=json.dumps(policy_document),
+                    role_id=role.id
+                )
+                self.session.add(inline_policy)
+            else:
+                inline_policy.document = json.dumps(policy_document)
+
+        for entity in record['trusted_entities']:
+            trusted_user = self.session.query(TrustedUser).filter_by(user_arn=entity, account_id=account_id, role_id=role.id).first()
+            if not trusted_user:
+                trusted_user = TrustedUser(
+                    user_arn=entity,
+                    account_id=account_id,
+                    role_id=role.id
+                )
+                self.session.add(trusted_user)
+
+    def save_user(self, record):
+        user_record = self.session.query(User).filter_by(user_name=record['name'], account_id=record['account_id']).first()
         if not user_record:
             user_record = User(
-                user_name=user_name,
-                account_id=account.id
+                user_name=record['name'],
+                account_id=record['account_id']
             )
             self.session.add(user_record)
             self.session.flush()
 
-        for policy_name, policy_arn in zip(attached_policy_names, attached_policy_arns):
-            policy_document = self.get_policy_document(iam_client, policy_arn)
-            if policy_document:
-                attached_policy = UserAttachedPolicy.query.filter_by(name=policy_name, user_id=user_record.id).first()
-                if not attached_policy:
-                    attached_policy = UserAttachedPolicy(
-                        name=policy_name,
-                        document=json.dumps(policy_document),
-                        user_id=user_record.id
-                    )
-                    self.session.add(attached_policy)
-                else:
-                    attached_policy.document = json.dumps(policy_document)
+        for policy_name, policy_document in record['attached_policies'].items():
+            attached_policy = self.session.query(UserAttachedPolicy).filter_by(name=policy_name, user_id=user_record.id).first()
+            if not attached_policy:
+                attached_policy = UserAttachedPolicy(
+                    name=policy_name,
+                    document=json.dumps(policy_document),
+                    user_id=user_record.id
+                )
+                self.session.add(attached_policy)
+            else:
+                attached_policy.document = json.dumps(policy_document)
+
+        for policy_name, policy_document in record['inline_policies'].items():
+            inline_policy = self.session.query(UserInlinePolicy).filter_by(name=policy_name, user_id=user_record.id).first()
+            if not inline_policy:
+                inline_policy = UserInlinePolicy(
+                    name=policy_name,
+                    document=json.dumps(policy_document),
+                    user_id=user_record.id
+                )
+                self.session.add(inline_policy)
+            else:
+                inline_policy.document = json.dumps(policy_document)
+
+
+def create_analyzer(sts_client, session, record_dir=None, replay_dir=None, restart=False):
+    config = current_app.config
+    return AWSRoleAnalyzer(
+        sts_client,
+        session,
+        fetch_workers=config['SYNC_FETCH_WORKERS'],
+        queue_size=config['SYNC_QUEUE_SIZE'],
+        checkpoint_size=config['SYNC_CHECKPOINT_SIZE'],
+        checkpoint_max_age=config['SYNC_CHECKPOINT_MAX_AGE'],
+        restart=restart,
+        record_archive=IAMArchive(record_dir) if record_dir else None,
+        replay_archive=IAMArchive(replay_dir) if replay_dir else None
+    )
+
+
+def inventory_options(command):
+    options = [
+        click.option("--inventory", is_flag=True, help="Sync every role returned by list_roles instead of the configured roles."),
+        click.option("--path-prefix", help="Only list roles under this IAM path (implies --inventory)."),
+        click.option("--name", "name_patterns", multiple=True, help="Only sync roles whose name matches this glob (repeatable, implies --inventory)."),
+        click.option("--tag", "tags", multiple=True, help="Only sync roles with this KEY or KEY=VALUE tag (repeatable, implies --inventory)."),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def archive_options(command):
+    options = [
+        click.option("--record", "record_dir", type=click.Path(file_okay=False), help="Append every IAM/STS response to per-account archives in this directory."),
+        click.option("--replay", "replay_dir", type=click.Path(exists=True, file_okay=False), help="Sync from archives in this directory instead of calling AWS."),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def check_archive_options(record_dir, replay_dir):
+    if record_dir and replay_dir:
+        raise click.UsageError("--record and --replay cannot be combined.")
+
+
+def parse_inventory(analyzer, inventory, path_prefix, name_patterns, tags):
+    if not (inventory or path_prefix or name_patterns or tags):
+        return None
+    tag_filters = {}
+    for tag in tags:
+        key, separator, value = tag.partition('=')
+        tag_filters[key] = value if separator else None
+    return analyzer.build_inventory(path_prefix, name_patterns, tag_filters)
 
-        for policy_name in inline_policy_names:
-            policy_document = iam_client.get_user_policy(UserName=user_name, PolicyName=policy_name)
-            if 'PolicyDocument' in policy_document:
-                inline_policy = UserInlinePolicy.query.filter_by(name=policy_name, user_id=user_record.id).first()
-                if not inline_policy:
-                    inline_policy = UserInlinePolicy(
-                        name=policy_name,
-                        document=json.dumps(policy_document['PolicyDocument']),
-                        user_id=user_record.id
-                    )
-                    self.session.add(inline_policy)
-                else:
-                    inline_policy.document = json.dumps(policy_document['PolicyDocument'])
 
-        self.session.commit()
 def init_aws_analyzer(app):
     sts_client = boto3.client('sts')
 
     @app.cli.command("update-aws-data")
-    def update_aws_data():
+    @click.option("--restart", is_flag=True, help="Ignore stored checkpoints and sync every account from scratch.")
+    @inventory_options
+    @archive_options
+    def update_aws_data(restart, inventory, path_prefix, name_patterns, tags, record_dir, replay_dir):
+        check_archive_options(record_dir, replay_dir)
         with app.app_context():
             Session = scoped_session(sessionmaker(bind=db.engine))
             accounts = Account.query.all()
-            analyzer = AWSRoleAnalyzer(sts_client, Session())
-
-            async def process_accounts():
-                tasks = [asyncio.create_task(analyzer.analyze_account(account)) for account in accounts]
-                await asyncio.gather(*tasks)
-
-            asyncio.run(process_accounts())
+            analyzer = create_analyzer(sts_client, Session(), record_dir, replay_dir, restart)
+            inventory = parse_inventory(analyzer, inventory, path_prefix, name_patterns, tags)
+            asyncio.run(analyzer.analyze_accounts(accounts, inventory=inventory))
             print("AWS data update completed.")
 
     @app.cli.command("sync-account")
-    def sync_account(account_id):
+    @click.argument("account_id")
+    @click.option("--role", "roles", multiple=True, help="Sync only this role (repeatable).")
+    @click.option("--user", "users", multiple=True, help="Sync only this IAM user (repeatable).")
+    @click.option("--roles-only", is_flag=True, help="Sync the configured roles and skip IAM users.")
+    @click.option("--users-only", is_flag=True, help="Sync IAM users and skip roles.")
+    @click.option("--restart", is_flag=True, help="Ignore the stored checkpoint and sync the account from scratch.")
+    @inventory_options
+    @archive_options
+    def sync_account(account_id, roles, users, roles_only, users_only, restart, inventory, path_prefix, name_patterns, tags, record_dir, replay_dir):
+        check_archive_options(record_dir, replay_dir)
+        if (roles or users) and (roles_only or users_only) or (roles_only and users_only):
+            raise click.UsageError("--role/--user cannot be combined with --roles-only/--users-only, or those two with each other.")
+        inventory_requested = inventory or path_prefix or name_patterns or tags
+        if inventory_requested and (roles or users or users_only):
+            raise click.UsageError("Inventory options cannot be combined with --role, --user or --users-only.")
+
         with app.app_context():
             Session = scoped_session(sessionmaker(bind=db.engine))
             account = Account.query.get(account_id)
             if account:
-                analyzer = AWSRoleAnalyzer(sts_client, Session())
-                asyncio.run(analyzer.analyze_account(account))
+                # A role outside roles_to_analyze would be stored now and
+                # removed again by the next full sync.
+                unconfigured_roles = [role_name for role_name in roles if role_name not in account.roles_to_analyze]
+                if unconfigured_roles:
+                    raise click.UsageError(f"Roles not in the account's roles to analyze: {', '.join(unconfigured_roles)}. Add them to the account first.")
+
+                analyzer = create_analyzer(sts_client, Session(), record_dir, replay_dir, restart)
+                inventory = parse_inventory(analyzer, inventory, path_prefix, name_patterns, tags)
+
+                async def run_sync():
+                    if roles or users:
+                        if roles:
+                            await analyzer.sync_roles(account, list(roles))
+                        if users:
+                            await analyzer.sync_users(account, list(users))
+                    elif roles_only:
+                        await analyzer.sync_roles(account, inventory=inventory)
+                    elif users_only:
+                        await analyzer.sync_users(account)
+                    else:
+                        await analyzer.analyze_account(account, inventory=inventory)
+
+                asyncio.run(run_sync())
                 print(f"Account {account.account_name} synced successfully.")
             else:
-                print(f"Account with ID {account_id} not found.")
\ No newline at end of file
+                print(f"Account with ID {account_id} not found.")
@@ -6,3 +6,7 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = os.getenv('SQLALCHEMY_TRACK_MODIFICATIONS')
+    SYNC_FETCH_WORKERS = int(os.getenv('SYNC_FETCH_WORKERS', 8))
+    SYNC_QUEUE_SIZE = int(os.getenv('SYNC_QUEUE_SIZE', 100))
+    SYNC_CHECKPOINT_SIZE = int(os.getenv('SYNC_CHECKPOINT_SIZE', 25))
+    SYNC_CHECKPOINT_MAX_AGE = int(os.getenv('SYNC_CHECKPOINT_MAX_AGE', 86400))
@@ -0,0 +1,167 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import zlib
+from datetime import datetime
+import botocore.session
+from botocore import xform_name
+from botocore.errorfactory import ClientExceptionsFactory
+
+
+class ArchiveMissError(LookupError):
+    pass
+
+
+class IAMArchive:
+    # One directory per account holding a gzip JSON Lines file per run, so a
+    # killed run can only truncate its own file. Writers are fully flushed at
+    # every sync checkpoint, and loading stops cleanly at a truncated tail.
+    # Runs are read oldest first and the latest response for a call wins.
+    def __init__(self, directory):
+        self.directory = directory
+        self.run_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}"
+        self.writers = {}
+        self.clients = {}
+        self.exceptions = None
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def account_directory(self, account_id):
+        return os.path.join(self.directory, account_id)
+
+    def path(self, account_id):
+        return os.path.join(self.account_directory(account_id), f"{self.run_id}.jsonl.gz")
+
+    def record(self, account_id, operation, params, response):
+        response = {k: v for k, v in response.items() if k != 'ResponseMetadata'}
+        if 'Credentials' in response:
+            response['Credentials'] = {k: 'REDACTED' for k in response['Credentials']}
+        line = json.dumps({'operation': operation, 'params': params, 'response': response}, default=str)
+        with self.lock:
+            writer = self.writers.get(account_id)
+            if writer is None:
+                os.makedirs(self.account_directory(account_id), exist_ok=True)
+                writer = self.writers[account_id] = gzip.open(self.path(account_id), 'ab')
+            writer.write((line + '\n').encode('utf-8'))
+
+    def attach(self, client, account_id):
+        # Hooks into the client's event system, so paginated calls are
+        # recorded page by page just like direct calls.
+        def capture_params(params, context, **kwargs):
+            context['archive_params'] = dict(params)
+
+        def capture_response(parsed, model, context, **kwargs):
+            self.record(account_id, model.name, context.get('archive_params', {}), parsed)
+
+        client.meta.events.register('before-parameter-build', capture_params)
+        client.meta.events.register('after-call', capture_response)
+        return client
+
+    def flush(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.flush(zlib.Z_FULL_FLUSH)
+
+    def close(self):
+        with self.lock:
+            for writer in self.writers.values():
+                writer.close()
+            self.writers = {}
+
+    def client(self, account_id):
+        with self.lock:
+            if account_id not in self.clients:
+                if self.exceptions is None:
+                    service_model = botocore.session.get_session().get_service_model('iam')
+                    self.exceptions = ClientExceptionsFactory().create_client_exceptions(service_model)
+                self.clients[account_id] = ReplayClient(self.load(account_id), self.exceptions)
+            return self.clients[account_id]
+
+    def load(self, account_id):
+        account_directory = self.account_directory(account_id)
+        runs = sorted(name for name in os.listdir(account_directory) if name.endswith('.jsonl.gz')) if os.path.isdir(account_directory) else []
+        if not runs:
+            raise ArchiveMissError(f"No recorded archive for account {account_id} in {self.directory}")
+
+        responses = {}
+        for run in runs:
+            for line in self.read_lines(os.path.join(account_directory, run)):
+                entry = json.loads(line)
+                responses[replay_key(entry['operation'], entry['params'])] = entry['response']
+        return responses
+
+    def read_lines(self, path):
+        # Members are decompressed by hand so that everything before a
+        # truncated or corrupt tail is still returned.
+        with open(path, 'rb') as archive:
+            data = archive.read()
+        text = b''
+        truncated = False
+        while data:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            try:
+                text += decompressor.decompress(data)
+            except zlib.error:
+                truncated = True
+                break
+            if not decompressor.eof:
+                truncated = True
+                break
+            data = decompressor.unused_data
+
+        lines = text.split(b'\n')
+        if lines[-1]:
+            truncated = True
+        if truncated:
+            self.logger.warning(f"Archive {path} is truncated; replaying the complete records before the cut.")
+        return [line.decode('utf-8') for line in lines[:-1]]
+
+
+def replay_key(operation, params):
+    return operation, json.dumps(params, sort_keys=True, default=str)
+
+
+class ReplayPaginator:
+    def __init__(self, client, operation_name):
+        self.client = client
+        self.operation_name = operation_name
+
+    def paginate(self, **params):
+        # IAM pages with IsTruncated/Marker, which is all the analyzer uses.
+        method = getattr(self.client, self.operation_name)
+        while True:
+            page = method(**params)
+            yield page
+            if not page.get('IsTruncated'):
+                break
+            params = dict(params, Marker=page['Marker'])
+
+
+class ReplayClient:
+    # Stands in for a botocore IAM client, answering from recorded responses.
+    # Recorded errors are raised as the same exception classes botocore uses.
+    def __init__(self, responses, exceptions):
+        self.responses = responses
+        self.operations = {xform_name(operation): operation for operation, _ in responses}
+        self.exceptions = exceptions
+
+    def get_paginator(self, operation_name):
+        return ReplayPaginator(self, operation_name)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        operation = self.operations.get(name)
+
+        def call(**params):
+            key = replay_key(operation, params)
+            if operation is None or key not in self.responses:
+                raise ArchiveMissError(f"No recorded response for {name}({params})")
+            response = self.responses[key]
+            if 'Error' in response:
+                raise self.exceptions.from_code(response['Error'].get('Code'))(response, operation)
+            return response
+
+        return call
@@ -1,3 +1,4 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
@@ -15,6 +16,7 @@ class Role(db.Model):
     role_name = db.Column(db.String(100), nullable=False)
     trust_policy = db.Column(db.Text, nullable=False)
     permissions_summary = db.Column(db.Text, nullable=False)
+    in_inventory = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     account_id = db.Column(db.String(12), db.ForeignKey('account.id'), nullable=False)
     attached_policies = db.relationship('AttachedPolicy', backref='role', lazy=True)
     inline_policies = db.relationship('InlinePolicy', backref='role', lazy=True)
@@ -61,3 +63,12 @@ class TrustedUser(db.Model):
     user_arn = db.Column(db.String(255), nullable=False)
     account_id = db.Column(db.String(12), db.ForeignKey('account.id'), nullable=False)
     role_id = db.Column(db.Integer, db.ForeignKey('role.id'), nullable=False)
+
+
+class SyncCheckpoint(db.Model):
+    account_id = db.Column(db.String(12), db.ForeignKey('account.id'), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='in_progress')
+    scope = db.Column(db.JSON, nullable=True)
+    completed_roles = db.Column(db.JSON, nullable=False, default=[])
+    completed_users = db.Column(db.JSON, nullable=False, default=[])
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,9 +1,9 @@
 from flask import Blueprint, render_template, redirect, url_for, request, jsonify, abort, flash, send_file
-from app.models import InlinePolicy, UserAttachedPolicy, UserInlinePolicy, db, Account, Role, TrustedUser, User, AttachedPolicy
+from app.models import InlinePolicy, UserAttachedPolicy, UserInlinePolicy, db, Account, Role, TrustedUser, User, AttachedPolicy, SyncCheckpoint
 from collections import defaultdict
 import json
 import asyncio
-from app.aws_analyzer import AWSRoleAnalyzer
+from app.aws_analyzer import create_analyzer
 import boto3
 import pandas as pd
 import os
@@ -156,7 +156,7 @@ def fetch_user_details(trusted_users):
 def update_data():
     try:
         accounts = Account.query.all()
-        analyzer = AWSRoleAnalyzer(sts_client, db.session)
+        analyzer = create_analyzer(sts_client, db.session)
 
         for account in accounts:
             try:
@@ -179,7 +179,7 @@ def add_account():
         account_id = request.form['account_id']
         account_name = request.form['account_name']
         role_arn = request.form['role_arn']
-        roles_to_analyze = request.form['roles_to_analyze'].split(',')
+        roles_to_analyze = parse_roles_to_analyze(request.form['roles_to_analyze'])
 
         if not account_id or not account_name or not role_arn:
             flash('Error: Account ID, Account Name, and Role ARN are required', 'error')
@@ -209,8 +209,11 @@ def manage_accounts():
         accounts = Account.query.paginate(page=page, per_page=10)
     return render_template('manage-accounts.html', accounts=accounts, search_query=search_query)
 
+def parse_roles_to_analyze(value):
+    return [role_name.strip() for role_name in value.split(',') if role_name.strip()]
+
 async def sync_aws_data_async(account):
-    analyzer = AWSRoleAnalyzer(sts_client, db.session)
+    analyzer = create_analyzer(sts_client, db.session)
     await analyzer.analyze_account(account)
 
 @main_bp.route('/edit_account/<int:account_id>', methods=['GET', 'POST'])
@@ -218,11 +221,23 @@ def edit_account(account_id):
     account = Account.query.get(account_id)
     if request.method == 'POST':
         try:
+            previous_role_arn = account.role_arn
+            previous_roles = list(account.roles_to_analyze)
             account.account_name = request.form['account_name']
             account.role_arn = request.form['role_arn']
-            account.roles_to_analyze = request.form['roles_to_analyze'].split(',')
+            account.roles_to_analyze = parse_roles_to_analyze(request.form['roles_to_analyze'])
             db.session.commit()
-            asyncio.run(sync_aws_data_async(account))
+
+            # A name change needs no AWS calls; role list changes only touch the roles involved.
+            if account.role_arn != previous_role_arn:
+                asyncio.run(sync_aws_data_async(account))
+            else:
+                analyzer = create_analyzer(sts_client, db.session)
+                for role_name in set(previous_roles) - set(account.roles_to_analyze):
+                    asyncio.run(analyzer.remove_role(account.id, role_name))
+                added_roles = [role_name for role_name in account.roles_to_analyze if role_name not in previous_roles]
+                if added_roles:
+                    asyncio.run(analyzer.sync_roles(account, added_roles))
             flash("Account updated successfully", "success")
         except Exception as e:
             flash(f"An error occurred while updating the account: {str(e)}", "danger")
@@ -236,6 +251,7 @@ def delete_account(account_id):
         Role.query.filter_by(account_id=account.id).delete()
         User.query.filter_by(account_id=account.id).delete()
         TrustedUser.query.filter_by(account_id=account.id).delete()
+        SyncCheckpoint.query.filter_by(account_id=account.id).delete()
         db.session.delete(account)
         db.session.commit()
         flash("Account deleted successfully", "success")
@@ -251,9 +267,10 @@ def add_role():
         account = Account.query.get(account_id)
         if account:
             if role_name not in account.roles_to_analyze:
-                account.roles_to_analyze.append(role_name)
+                account.roles_to_analyze = account.roles_to_analyze + [role_name]
                 db.session.commit()
-                asyncio.run(sync_aws_data_async(account))
+                analyzer = create_analyzer(sts_client, db.session)
+                asyncio.run(analyzer.sync_role(account, role_name))
         flash("Role added successfully", "success")
     except Exception as e:
         flash(f"An error occurred while adding the role: {str(e)}", "danger")
@@ -267,10 +284,10 @@ def remove_role():
         account = Account.query.get(account_id)
         if account:
             if role_name in account.roles_to_analyze:
-                account.roles_to_analyze.remove(role_name)
+                account.roles_to_analyze = [name for name in account.roles_to_analyze if name != role_name]
                 db.session.commit()
 
-                analyzer = AWSRoleAnalyzer(sts_client, db.session)
+                analyzer = create_analyzer(sts_client, db.session)
                 asyncio.run(analyzer.remove_role(account.id, role_name))
 
         flash("Role removed successfully", "success")